@@ -37,6 +37,7 @@ from .filename_helper import (
 )
 
 ENCODING = 'UTF-8'
+WRITE_BUFSIZE = 1 << 20
 REQUIRED_PROFILE_VERSION = '20221213'
 FILENAME_DELIMITERS = (' ', '_', '-')
 PAIRED_FASTQ_MARKER = ('1', '2')
@@ -481,9 +482,11 @@ def align(
             ivar_trim_config=ivar_trim_config
         )
         codfreqfile = name_codfreq(pairobj['name'])
-        with open(codfreqfile, 'w', encoding='utf-8-sig') as fp:
-            writer = csv.DictWriter(fp, CODFREQ_HEADER)
-            writer.writeheader()
+        with open(
+            codfreqfile, 'w', encoding='utf-8-sig', buffering=WRITE_BUFSIZE
+        ) as fp:
+            writer = csv.writer(fp)
+            writer.writerow(CODFREQ_HEADER)
             for row in sam2codfreq_all(
                 name=pairobj['name'],
                 fnpair=pairobj['pair'],
@@ -491,14 +494,16 @@ def align(
                 workers=workers,
                 log_format=log_format
             ):
-                writer.writerow({
-                    **row,
-                    'codon': row['codon'].decode(ENCODING)
-                })
+                gene, position, total, codon, count, qua = row
+                writer.writerow((
+                    gene, position, total,
+                    codon.decode(ENCODING), count, qua
+                ))
 
         create_untrans_region_consensus(
             pairobj['name'],
-            profile_obj
+            profile_obj,
+            workers=workers
         )
 
 
@@ -1,4 +1,5 @@
-from typing import List, Optional, ByteString
+from typing import List, Optional, ByteString, BinaryIO, Iterator, cast
+from contextlib import contextmanager
 from subprocess import Popen, PIPE
 
 
@@ -26,6 +27,35 @@ def compress(
     return out
 
 
+@contextmanager
+def compress_to(
+    fp: BinaryIO,
+    compresslevel: int = 9,
+    *,
+    mtime: Optional[float] = None
+) -> Iterator[BinaryIO]:
+    error: bytes
+    cmd: List[str] = ['pigz', f'-{compresslevel}', '-c']
+    if mtime:
+        cmd.extend(['-M', f'{mtime}'])
+    proc: Popen = Popen(
+        cmd,
+        stdin=PIPE,
+        stdout=fp,
+        stderr=PIPE)
+    stdin: BinaryIO = cast(BinaryIO, proc.stdin)
+    try:
+        yield stdin
+    finally:
+        stdin.close()
+        error = cast(BinaryIO, proc.stderr).read()
+        proc.wait()
+    if error:
+        error_text: str = error.decode('UTF-8').strip()
+        if error_text:
+            raise RuntimeError(error_text)
+
+
 def decompress(data: ByteString) -> bytes:
     out: bytes
     error: bytes
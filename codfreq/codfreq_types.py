@@ -84,13 +84,9 @@ class Profile(TypedDict):
     sequenceAssemblyConfig: List[SequenceAssemblyConfig]
 
 
-class CodFreqRow(TypedDict):
-    gene: GeneText
-    position: AAPos
-    total: int
-    codon: CodonText
-    count: int
-    total_quality_score: int
+#                                  total           count Qual
+#                                    v               v    v
+CodFreqRow = Tuple[GeneText, AAPos, int, CodonText, int, int]
 
 
 #                                 refStart refEnd
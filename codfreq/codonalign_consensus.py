@@ -56,24 +56,6 @@ def get_sequence_obj(
     )
 
 
-@cython.cfunc
-@cython.inline
-@cython.returns(int)
-def aapos_to_napos(
-    aapos: AAPos,
-    refranges: List[NAPosRange]
-) -> NAPos:
-    max_rel_napos = 0
-    for start, end in refranges:
-        max_rel_napos += end - start + 1
-        max_aapos = max_rel_napos // 3
-        if aapos <= max_aapos:
-            rel_napos = aapos * 3 - 2
-            napos_offset = max_rel_napos - rel_napos
-            return end - napos_offset
-    return -1
-
-
 @cython.cfunc
 @cython.inline
 @cython.returns(tuple)
@@ -89,8 +71,8 @@ def assemble_alignment(
 ]:
     aapos: AAPos
     napos: NAPos
-    ref_codon: bytearray
-    cons_codon: bytearray
+    start: NAPos
+    end: NAPos
     cons_codon_bytes: bytes
     cons_codon_size: int
     codons: Optional[Counter[CodonText]]
@@ -101,28 +83,30 @@ def assemble_alignment(
     refsize: int = sum(end - start + 1 for start, end in frag_refranges)
     first_aa: AAPos = refsize // 3
     last_aa: AAPos = 0
+    max_rel_napos: int = 0
+    prev_max_aapos: AAPos = 0
 
-    for aapos in range(1, refsize // 3 + 1):
-        napos = aapos_to_napos(aapos, frag_refranges)
-        if napos == -1:
-            # aapos is out of range, should we raise error?
-            continue
-        ref_codon = refseq[napos - 1:napos + 2]
-        codons = codonstat_by_fragpos.get((fragment_name, aapos))
-        if codons:
-            ((cons_codon_bytes, _),) = codons.most_common(1)
-            first_aa = min(first_aa, aapos)
-            last_aa = max(last_aa, aapos)
-        else:
-            cons_codon_bytes = DEL_CODON
-        cons_codon = bytearray(cons_codon_bytes)
-        cons_codon_size = len(cons_codon_bytes)
-        if cons_codon_size < 3:
-            cons_codon.extend([GAP] * (3 - cons_codon_size))
-        elif cons_codon_size > 3:
-            ref_codon.extend([GAP] * (cons_codon_size - 3))
-        frag_refseq.extend(ref_codon)
-        frag_queryseq.extend(cons_codon)
+    for start, end in frag_refranges:
+        # a codon belongs to the first range which covers its last NA; its
+        # napos is counted backward from the end of that range
+        max_rel_napos += end - start + 1
+        for aapos in range(prev_max_aapos + 1, max_rel_napos // 3 + 1):
+            napos = end - max_rel_napos + aapos * 3 - 2
+            codons = codonstat_by_fragpos.get((fragment_name, aapos))
+            if codons:
+                ((cons_codon_bytes, _),) = codons.most_common(1)
+                first_aa = min(first_aa, aapos)
+                last_aa = max(last_aa, aapos)
+            else:
+                cons_codon_bytes = DEL_CODON
+            cons_codon_size = len(cons_codon_bytes)
+            frag_refseq.extend(refseq[napos - 1:napos + 2])
+            frag_queryseq.extend(cons_codon_bytes)
+            if cons_codon_size < 3:
+                frag_queryseq.extend(DEL_CODON[cons_codon_size:])
+            elif cons_codon_size > 3:
+                frag_refseq.extend(b'-' * (cons_codon_size - 3))
+        prev_max_aapos = max_rel_napos // 3
 
     if last_aa == 0:
         return None, None, None, None
@@ -109,21 +109,68 @@ AMBIGUOUS_NAS: Dict[NAChar, MultiNAText] = {
 }
 
 
+def build_na_bitmask() -> bytes:
+    """Encode each NA as a 4-bit mask (A=1, C=2, G=4, T=8)
+
+    An ambiguous NA is the union of its expansions; a gap is treated as "N".
+    Unknown characters are encoded as 0.
+    """
+    na: NAChar
+    bitmask: bytearray = bytearray(256)
+    for na, bit in zip(b'ACGT', (1, 2, 4, 8)):
+        bitmask[na] = bit
+    for na, expanded in AMBIGUOUS_NAS.items():
+        for bit_na in expanded:
+            bitmask[na] |= bitmask[bit_na]
+    bitmask[ord(b'-')] = bitmask[ord(b'N')]
+    return bytes(bitmask)
+
+
+NA_BITMASK: bytes = build_na_bitmask()
+
+
+def build_codon_radix_table() -> List[MultiAAText]:
+    """Precompute AAs of every unambiguous/ambiguous codon
+
+    The table is indexed by the three NA bitmasks of a codon packed as
+    `(mask0 << 8) | (mask1 << 4) | mask2`. Entries of codons containing an
+    unknown NA are left empty.
+    """
+    key: int
+    aas: Set[AAChar]
+    bitmask_nas: Dict[int, MultiNAText] = {
+        bitmask: bytes(
+            na for na in b'ACGT' if NA_BITMASK[na] & bitmask
+        )
+        for bitmask in range(16)
+    }
+    table: List[MultiAAText] = [b''] * 0x1000
+    for key in range(0x1000):
+        nas0 = bitmask_nas[key >> 8]
+        nas1 = bitmask_nas[key >> 4 & 0xf]
+        nas2 = bitmask_nas[key & 0xf]
+        aas = set()
+        for na0 in nas0:
+            for na1 in nas1:
+                for na2 in nas2:
+                    aas.add(CODON_TABLE[bytes([na0, na1, na2])][0])
+        table[key] = bytes(sorted(aas))
+    return table
+
+
+CODON_RADIX_TABLE: List[MultiAAText] = build_codon_radix_table()
+
+
 def expand_ambiguous_na(na: NAChar) -> MultiNAText:
     return AMBIGUOUS_NAS.get(na, bytes([na]))
 
 
 def translate_codon(nas: MultiNAText) -> MultiAAText:
-    aas_text: bytes
-    nas = nas.replace(b'-', b'N')[:3]
-    if nas in CODON_TABLE:
-        return CODON_TABLE[nas]
-    aas: Set[int] = set()
-    for na0 in AMBIGUOUS_NAS.get(nas[0], nas[0:1]):
-        for na1 in AMBIGUOUS_NAS.get(nas[1], nas[1:2]):
-            for na2 in AMBIGUOUS_NAS.get(nas[2], nas[2:3]):
-                aas |= set(
-                    CODON_TABLE[bytes([na0, na1, na2])]
-                )
-    CODON_TABLE[nas] = aas_text = bytes((sorted(aas)))
+    aas_text: MultiAAText = CODON_RADIX_TABLE[
+        NA_BITMASK[nas[0]] << 8 |
+        NA_BITMASK[nas[1]] << 4 |
+        NA_BITMASK[nas[2]]
+    ]
+    if not aas_text:
+        raise KeyError(nas[:3])
     return aas_text
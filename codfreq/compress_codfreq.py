@@ -7,16 +7,34 @@ from typing import (
     TextIO,
     BinaryIO,
     Optional,
-    ByteString
+    Generator
 )
 
 from .cmdwrappers import pigz
 from .codfreq_types import RegionalConsensus
 
 import click  # type: ignore
+import orjson
 
 EXT_UNTRANS_JSON = '.untrans.json'
 EXT_CODFREQ = '.codfreq'
+COPY_BUFSIZE = 1 << 16
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+def iter_filenames(
+    dirpath: str
+) -> Generator[Tuple[str, str], None, None]:
+    entry: os.DirEntry
+    subdirs: List[str] = []
+    with os.scandir(dirpath) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirs.append(entry.path)
+            else:
+                yield dirpath, entry.name
+    for subdir in subdirs:
+        yield from iter_filenames(subdir)
 
 
 def find_codfreq_untrans_pairs(
@@ -27,27 +45,26 @@ def find_codfreq_untrans_pairs(
     codfreq: Optional[str]
     pair: Tuple[Optional[str], Optional[str]]
     pairs: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
-    for dirpath, _, filenames in os.walk(workdir, followlinks=True):
-        for filename in filenames:
-            untrans_json = codfreq = None
-            if filename.startswith('.'):
-                continue
-            elif filename.endswith(EXT_CODFREQ):
-                key = filename[:-len(EXT_CODFREQ)]
-                codfreq = os.path.join(dirpath, filename)
-            elif filename.endswith(EXT_UNTRANS_JSON):
-                key = filename[:-len(EXT_UNTRANS_JSON)]
-                untrans_json = os.path.join(dirpath, filename)
-            else:
-                continue
-            key = os.path.join(dirpath, key)
-            if key in pairs:
-                pair = pairs[key]
-                if codfreq is None:
-                    codfreq = pair[0]
-                elif untrans_json is None:
-                    untrans_json = pair[1]
-            pairs[key] = (codfreq, untrans_json)
+    for dirpath, filename in iter_filenames(workdir):
+        untrans_json = codfreq = None
+        if filename.startswith('.'):
+            continue
+        elif filename.endswith(EXT_CODFREQ):
+            key = filename[:-len(EXT_CODFREQ)]
+            codfreq = os.path.join(dirpath, filename)
+        elif filename.endswith(EXT_UNTRANS_JSON):
+            key = filename[:-len(EXT_UNTRANS_JSON)]
+            untrans_json = os.path.join(dirpath, filename)
+        else:
+            continue
+        key = os.path.join(dirpath, key)
+        if key in pairs:
+            pair = pairs[key]
+            if codfreq is None:
+                codfreq = pair[0]
+            elif untrans_json is None:
+                untrans_json = pair[1]
+        pairs[key] = (codfreq, untrans_json)
     return [
         (codfreq, untrans_json)
         for codfreq, untrans_json in pairs.values()
@@ -70,27 +87,36 @@ def compress_codfreq(workdir: str, log_format: str) -> None:
     fp: BinaryIO
     text_fp: TextIO
     untrans_objs: RegionalConsensus
-    payload: ByteString
+    chunk: str
+    untrans_fp: BinaryIO
+    gz_fp: BinaryIO
+    untrans_data: bytes
     pairs: List[Tuple[
         str, Optional[str]
     ]] = find_codfreq_untrans_pairs(workdir)
     for codfreq, untrans in pairs:
-        payload = bytearray(b'\xef\xbb\xbf')  # UTF-8 bom
-        if untrans:
-            with open(untrans, 'rb') as fp:
-                payload.extend(b'# --- untranslated regions begin ---\n')
-                for untrans_obj in json.load(fp):
-                    payload.extend(
-                        '# {name} {refStart}..{refEnd}: {consensus}\n'
-                        .format(**untrans_obj)
-                        .encode('UTF-8')
-                    )
-                payload.extend(b'# --- untranslated regions end ---\n')
-        with open(codfreq, 'r', encoding='UTF-8-sig') as text_fp:
-            payload.extend(text_fp.read().encode('UTF-8'))
-        payload = pigz.compress(payload)
         with open(codfreq + '.gz', 'wb') as fp:
-            fp.write(payload)
+            with pigz.compress_to(fp) as gz_fp:
+                gz_fp.write(UTF8_BOM)
+                if untrans:
+                    with open(untrans, 'rb') as untrans_fp:
+                        untrans_data = untrans_fp.read()
+                    if untrans_data.startswith(UTF8_BOM):
+                        untrans_data = untrans_data[len(UTF8_BOM):]
+                    gz_fp.write(b'# --- untranslated regions begin ---\n')
+                    for untrans_obj in orjson.loads(untrans_data):
+                        gz_fp.write(
+                            '# {name} {refStart}..{refEnd}: {consensus}\n'
+                            .format(**untrans_obj)
+                            .encode('UTF-8')
+                        )
+                    gz_fp.write(b'# --- untranslated regions end ---\n')
+                with open(codfreq, 'r', encoding='UTF-8-sig') as text_fp:
+                    while True:
+                        chunk = text_fp.read(COPY_BUFSIZE)
+                        if not chunk:
+                            break
+                        gz_fp.write(chunk.encode('UTF-8'))
         if log_format == 'json':
             click.echo(json.dumps({
                 'op': 'compress-codfreq',
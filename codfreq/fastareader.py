@@ -1,30 +1,34 @@
-from typing import TextIO, List, Optional
+from typing import TextIO, List
 from .codfreq_types import Sequence
 
+WHITESPACES: bytes = b' \t\r\n\x0b\x0c'
+UPPERCASE: bytes = bytes.maketrans(
+    b'abcdefghijklmnopqrstuvwxyz',
+    b'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+)
+
 
 def load(fp: TextIO) -> List[Sequence]:
+    record: str
+    header: str
+    body: str
+    seqbytes: bytes
     sequences: List[Sequence] = []
-    header: Optional[str] = None
-    curseq: bytearray = bytearray()
-    for line in fp:
-        if line.startswith('>'):
-            if header and curseq:
-                sequences.append({
-                    'header': header,
-                    'sequence': curseq.upper().decode('U8')
-                })
-            header = line[1:].strip()
-            curseq = bytearray()
-        elif line.startswith('#'):
-            continue
-        else:
-            curseq.extend(
-                line.strip()
-                .encode('ASCII', errors='ignore')
+    for record in ('\n' + fp.read()).split('\n>')[1:]:
+        header, _, body = record.partition('\n')
+        header = header.strip()
+        if '#' in body:
+            body = '\n'.join(
+                line for line in body.split('\n')
+                if not line.startswith('#')
             )
-    if header and curseq:
-        sequences.append({
-            'header': header,
-            'sequence': curseq.upper().decode('U8')
-        })
+        seqbytes = (
+            body.encode('ASCII', errors='ignore')
+            .translate(UPPERCASE, WHITESPACES)
+        )
+        if header and seqbytes:
+            sequences.append({
+                'header': header,
+                'sequence': seqbytes.decode('ASCII')
+            })
     return sequences
@@ -27,25 +27,26 @@ class JsonProgress:
         self.total = total
         self.count = 0
         self.ts_interval = ts_interval
-        self.prev_ts = int(time.time() * 1000)
+        self.prev_ts = time.monotonic_ns() // 1_000_000
         self.op = op
         self.extras = extras
 
     def update(self, count: int) -> None:
         self.count += count
-        now: int = int(time.time() * 1000)
-        if now - self.prev_ts >= self.ts_interval:
-            self.prev_ts = now
-            click.echo(json.dumps({
-                'op': self.op,
-                'status': 'working',
-                'description': self.description,
-                'count': self.count,
-                'total': self.total,
-                'ts': now,
-                **self.extras
-            }))
-            sys.stdout.flush()
+        now: int = time.monotonic_ns() // 1_000_000
+        if now - self.prev_ts < self.ts_interval:
+            return
+        self.prev_ts = now
+        click.echo(json.dumps({
+            'op': self.op,
+            'status': 'working',
+            'description': self.description,
+            'count': self.count,
+            'total': self.total,
+            'ts': int(time.time() * 1000),
+            **self.extras
+        }))
+        sys.stdout.flush()
 
     def close(self) -> None:
         now: int = int(time.time() * 1000)
@@ -1,32 +1,47 @@
 import os
 import csv
-import json
 import click  # type: ignore
+import orjson
+from itertools import groupby
+from operator import itemgetter
 from datetime import datetime, timezone
 
+CODFREQ_SUFFIX = '.codfreq'
+UNTRANS_SUFFIX = '.untrans.json'
+UTF8_BOM = b'\xef\xbb\xbf'
+
 
 def utcnow_text():
     return datetime.now(tz=timezone.utc).isoformat()
 
 
-def yield_codfreqs(workdir):
-    suffix = '.codfreq'
-    for fname in os.listdir(workdir):
-        if not fname.endswith(suffix):
-            continue
-        name = fname.rsplit(suffix, 1)[0]
-        with open(os.path.join(workdir, fname), encoding='utf-8-sig') as fp:
-            yield name, csv.DictReader(fp)
+def scan_workdir(workdir):
+    codfreq_entries = []
+    untrans_entries = []
+    with os.scandir(workdir) as entries:
+        for entry in entries:
+            if entry.name.endswith(CODFREQ_SUFFIX):
+                codfreq_entries.append(entry)
+            elif entry.name.endswith(UNTRANS_SUFFIX):
+                untrans_entries.append(entry)
+    return codfreq_entries, untrans_entries
+
+
+def yield_codfreqs(entries):
+    for entry in entries:
+        name = entry.name.rsplit(CODFREQ_SUFFIX, 1)[0]
+        with open(entry.path, encoding='utf-8-sig') as fp:
+            yield name, csv.reader(fp)
 
 
-def yield_untrans(workdir):
-    suffix = '.untrans.json'
-    for fname in os.listdir(workdir):
-        if not fname.endswith(suffix):
-            continue
-        name = fname.rsplit(suffix, 1)[0]
-        with open(os.path.join(workdir, fname), encoding='utf-8-sig') as fp:
-            yield name, json.load(fp)
+def yield_untrans(entries):
+    for entry in entries:
+        name = entry.name.rsplit(UNTRANS_SUFFIX, 1)[0]
+        with open(entry.path, 'rb') as fp:
+            data = fp.read()
+        if data.startswith(UTF8_BOM):
+            data = data[len(UTF8_BOM):]
+        yield name, orjson.loads(data)
 
 
 @click.command()
@@ -39,32 +54,41 @@ def make_response(workdir, path_prefix):
     uniqkey = path_prefix.split('/', 1)[-1]
     """Create CodFreq file for response"""
     codfreqs = {}
-    for name, rows in yield_codfreqs(workdir):
+    codfreq_entries, untrans_entries = scan_workdir(workdir)
+    for name, rows in yield_codfreqs(codfreq_entries):
         name = '{}.codfreq'.format(name)
-        gpmap = {}
-        for row in rows:
-            gene = row['gene']
-            pos = int(row['position'])
-            total = int(row['total'])
-            codon = row['codon']
-            if len(codon) < 3:
-                continue
-            count = int(row['count'])
-            total_quality_score = float(row['total_quality_score'])
-            if (gene, pos) not in gpmap:
-                gpmap[(gene, pos)] = {
+        header = next(rows)
+        get_gene_pos = itemgetter(
+            header.index('gene'),
+            header.index('position')
+        )
+        idx_total = header.index('total')
+        idx_codon = header.index('codon')
+        idx_count = header.index('count')
+        idx_qual = header.index('total_quality_score')
+        all_reads = codfreqs.setdefault(name, [])
+        for (gene, pos), group in groupby(rows, get_gene_pos):
+            total = None
+            codon_reads = []
+            for row in group:
+                codon = row[idx_codon]
+                if len(codon) < 3:
+                    continue
+                if total is None:
+                    total = int(row[idx_total])
+                codon_reads.append({
+                    'codon': codon,
+                    'reads': int(row[idx_count]),
+                    'totalQualityScore': float(row[idx_qual])
+                })
+            if codon_reads:
+                all_reads.append({
                     'gene': gene,
-                    'position': pos,
+                    'position': int(pos),
                     'totalReads': total,
-                    'allCodonReads': []
-                }
-            gpmap[(gene, pos)]['allCodonReads'].append({
-                'codon': codon,
-                'reads': count,
-                'totalQualityScore': total_quality_score
-            })
-        codfreqs.setdefault(name, []).extend(gpmap.values())
-    untrans_lookup = dict(yield_untrans(workdir))
+                    'allCodonReads': codon_reads
+                })
+    untrans_lookup = dict(yield_untrans(untrans_entries))
     codfreqs = [{
         'name': name,
         'untranslatedRegions': untrans_lookup.get(
@@ -72,8 +96,8 @@ def make_response(workdir, path_prefix):
         ),
         'allReads': all_reads
     } for name, all_reads in codfreqs.items()]
-    with open(os.path.join(workdir, 'response.json'), 'w') as fp:
-        fp.write(json.dumps({
+    with open(os.path.join(workdir, 'response.json'), 'wb') as fp:
+        fp.write(orjson.dumps({
             'taskKey': uniqkey,
             'lastUpdatedAt': utcnow_text(),
             'status': 'success',
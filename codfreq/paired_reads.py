@@ -2,10 +2,13 @@
 
 import pysam  # type: ignore
 from pysam import AlignedSegment  # type: ignore
+from itertools import groupby
+from operator import attrgetter
 from collections import OrderedDict
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Generator
 
 from .codfreq_types import Header
+from .samfile_helper import BAM_THREADS
 
 __all__ = ['PairedReads', 'iter_paired_reads']
 
@@ -15,13 +18,22 @@ PairedReads = Tuple[str, List[pysam.AlignedSegment]]
 
 def iter_paired_reads(
     samfile: str
-) -> List[PairedReads]:
-    idx: int
+) -> Generator[PairedReads, None, None]:
     name: Header
     read: AlignedSegment
+    reads: List[AlignedSegment]
     paired_reads: Dict[str, List[AlignedSegment]] = OrderedDict()
-    with pysam.AlignmentFile(samfile, 'rb') as fp:
-        for idx, read in enumerate(fp.fetch()):
+    with pysam.AlignmentFile(samfile, 'rb', threads=BAM_THREADS) as fp:
+        if fp.header.to_dict().get('HD', {}).get('SO') == 'queryname':
+            # reads of the same query are adjacent; stream them as they come
+            for name, group in groupby(
+                fp.fetch(until_eof=True),
+                attrgetter('query_name')
+            ):
+                reads = list(group)
+                yield name, reads
+            return
+        for read in fp.fetch():
             name = read.query_name
             paired_reads.setdefault(name, []).append(read)
-    return list(paired_reads.items())
+    yield from paired_reads.items()
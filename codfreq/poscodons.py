@@ -1,8 +1,7 @@
 import cython  # type: ignore
 import pysam  # type: ignore
 from pysam import AlignedSegment  # type: ignore
-from typing import List, DefaultDict, Tuple, Generator, Optional
-from collections import defaultdict
+from typing import List, Dict, Tuple, Generator, Optional
 
 from .codfreq_types import (
     FragmentInterval,
@@ -13,107 +12,153 @@ from .codfreq_types import (
     NAPosRange,
     CodonText
 )
-from .posnas import iter_single_read_posnas, PosNA
+from .posnas import iter_single_read_posnas
+from .posnas_types import PosNA
 
-#                                          Qual
-#                                           v
-PosCodon = Tuple[Header, AAPos, CodonText, int]
+#                                           Qual
+#                                            v
+PosCodon = Tuple[Tuple[Header, AAPos, CodonText], int]
 BasePair = Tuple[AAPos, List[PosNA]]
 
+# fragment intervals of the current job and their napos lookup, set once per
+# process by init_fragment_intervals
+FRAGMENT_INTERVALS: List[FragmentInterval] = []
+NAPOS_LOOKUP: List[List[Tuple[int, AAPos]]] = []
+
 
 @cython.cfunc
 @cython.inline
 @cython.returns(list)
+@cython.locals(prev_pos=cython.long, napos=cython.long)
 def group_posnas_by_napos(
     posnas: List[PosNA]
 ) -> List[Tuple[NAPos, List[PosNA]]]:
-    prev_pos: int = -1
+    napos: NAPos
+    prev_pos: NAPos = -1
+    group: List[PosNA] = []
     by_napos: List[Tuple[NAPos, List[PosNA]]] = []
     for posna in posnas:
-        if prev_pos == posna[0]:
-            by_napos[-1][1].append(posna)
+        napos = posna[0]
+        if napos == prev_pos:
+            group.append(posna)
         else:
-            prev_pos = posna[0]
-            by_napos.append((posna[0], [posna]))
+            prev_pos = napos
+            group = [posna]
+            by_napos.append((napos, group))
     return by_napos
 
 
 @cython.cfunc
 @cython.inline
 @cython.returns(list)
+@cython.locals(
+    frag_idx=cython.Py_ssize_t,
+    napos=cython.long,
+    rel_napos0=cython.long,
+    start=cython.long,
+    end=cython.long
+)
+def build_napos_lookup(
+    fragment_intervals: List[FragmentInterval]
+) -> List[List[Tuple[int, AAPos]]]:
+    """Map each refpos to the fragments and AA positions it belongs to
+
+    The returned list is indexed by refpos and covers up to the last refpos
+    of all fragments. Each item lists (fragment index, AA position) pairs
+    in fragment and refrange order.
+    """
+    frag_idx: int
+    napos: NAPos
+    rel_napos0: int
+    start: NAPos
+    end: NAPos
+    frag_refranges: List[NAPosRange]
+    size: int = max([
+        end + 1
+        for frag_refranges, _ in fragment_intervals
+        for _, end in frag_refranges
+    ], default=0)
+    napos_lookup: List[List[Tuple[int, AAPos]]] = [[] for _ in range(size)]
+
+    for frag_idx, (frag_refranges, _) in enumerate(fragment_intervals):
+        rel_napos0 = 0
+        for start, end in frag_refranges:
+            for napos in range(start, end + 1):
+                napos_lookup[napos].append((
+                    frag_idx,
+                    (rel_napos0 + napos - start) // 3 + 1
+                ))
+            rel_napos0 += end - start + 1
+    return napos_lookup
+
+
+@cython.cfunc
+@cython.inline
+@cython.returns(list)
+@cython.locals(
+    napos=cython.long,
+    frag_idx=cython.Py_ssize_t,
+    lookup_size=cython.Py_ssize_t
+)
 def group_basepairs(
     posnas: List[PosNA],
-    fragment_intervals: List[FragmentInterval]
+    fragment_intervals: List[FragmentInterval],
+    napos_lookup: List[List[Tuple[int, AAPos]]]
 ) -> List[Tuple[Header, List[BasePair]]]:
     """Group same base-pair posnas (NA and ins) by its fragment AA position"""
 
     napos: NAPos
     na_and_ins: List[PosNA]
     aapos: AAPos
-    frag_refranges: List[NAPosRange]
-    fragment_name: Header
+    frag_idx: int
+    fragment_bps: Optional[List[BasePair]]
 
     posnas_by_napos: List[
         Tuple[NAPos, List[PosNA]]
     ] = group_posnas_by_napos(posnas)
-    basepairs: DefaultDict[Header, List[BasePair]] = defaultdict(list)
+    lookup_size: int = len(napos_lookup)
+    basepairs: Dict[int, List[BasePair]] = {}
 
     for napos, na_and_ins in posnas_by_napos:
-        for frag_refranges, fragment_name in fragment_intervals:
-            rel_napos0 = 0
-            for start, end in frag_refranges:
-                if napos >= start and napos <= end:
-                    aapos = (rel_napos0 + napos - start) // 3 + 1
-                    basepairs[fragment_name].append((
-                        aapos,
-                        na_and_ins
-                    ))
-                rel_napos0 += end - start + 1
-    return list(basepairs.items())
-
-
-@cython.cfunc
-@cython.inline
-@cython.returns(list)
-def find_intersected_fragments(
-    fragment_intervals: List[FragmentInterval],
-    read_refstart: NAPos,
-    read_refend: NAPos
-) -> List[FragmentInterval]:
-    frag_refranges: List[NAPosRange]
-    fragment_name: Header
-    filtered: List[FragmentInterval] = []
-    for frag_refranges, fragment_name in fragment_intervals:
-        if all(read_refend < start for start, _ in frag_refranges):
-            continue
-        if all(read_refstart > end for _, end in frag_refranges):
-            continue
-        filtered.append((frag_refranges, fragment_name))
-    return filtered
+        if napos >= lookup_size:
+            # posnas are sorted; none of the rest is in a fragment
+            break
+        for frag_idx, aapos in napos_lookup[napos]:
+            fragment_bps = basepairs.get(frag_idx)
+            if fragment_bps is None:
+                fragment_bps = basepairs[frag_idx] = []
+            fragment_bps.append((aapos, na_and_ins))
+    return [
+        (fragment_intervals[frag_idx][1], fragment_bps)
+        for frag_idx, fragment_bps in sorted(basepairs.items())
+    ]
 
 
 @cython.cfunc
 @cython.inline
 @cython.returns(tuple)
+@cython.locals(totalq=cython.long)
 def get_comparable_codon(
     codon_posnas: List[List[PosNA]]
-) -> Tuple[CodonText, bool]:
+) -> Tuple[CodonText, bool, int]:
+    """Join the NAs of a codon and sum up their qualities"""
     posnas: List[PosNA]
     codon_chars: List[NAChar] = []
-    num_bps: int = 0
+    totalq: int = 0
 
     for posnas in codon_posnas:
-        num_bps += 1
         for posna in posnas:
             codon_chars.append(posna[2])
+            totalq += posna[3]
 
-    is_partial: bool = num_bps < 3
-    return bytes(codon_chars), is_partial
+    is_partial: bool = len(codon_posnas) < 3
+    return bytes(codon_chars), is_partial, totalq
 
 
 @cython.cfunc
 @cython.inline
 @cython.returns(list)
+@cython.locals(aapos=cython.long, prev_aapos=cython.long)
 def group_codons(
     basepairs: List[Tuple[Header, List[BasePair]]]
 ) -> List[Tuple[Header, AAPos, List[List[PosNA]]]]:
@@ -127,31 +172,37 @@ def group_codons(
     fragment_name: Header
     fragment_bps: List[BasePair]
 
-    bp: List[PosNA]
+    codon_bps: List[List[PosNA]] = []
     codons: List[Tuple[Header, AAPos, List[List[PosNA]]]] = []
 
     for fragment_name, fragment_bps in basepairs:
         prev_aapos: AAPos = -1
         for aapos, na_and_ins in fragment_bps:
             if aapos == prev_aapos:
-                codons[-1][2].append(na_and_ins)
+                codon_bps.append(na_and_ins)
             else:
                 prev_aapos = aapos
-                codons.append((fragment_name, aapos, [na_and_ins]))
+                codon_bps = [na_and_ins]
+                codons.append((fragment_name, aapos, codon_bps))
     return codons
 
 
 @cython.cfunc
 @cython.inline
 @cython.returns(list)
+@cython.locals(
+    site_quality_cutoff=cython.long,
+    totalq=cython.long,
+    sizeq=cython.long,
+    remq=cython.long,
+    meanq_int=cython.long
+)
 def posnas2poscodons(
     posnas: List[PosNA],
     fragment_intervals: List[FragmentInterval],
-    read_refstart: int,  # 1-based first aligned refpos
-    read_refend: int,    # 1-based last aligned refpos
+    napos_lookup: List[List[Tuple[int, AAPos]]],
     site_quality_cutoff: int
 ) -> List[PosCodon]:
-    meanq: List[int]
     meanq_int: int
     fragment_name: Header
     aapos: AAPos
@@ -160,47 +211,64 @@ def posnas2poscodons(
     is_partial: bool
     totalq: int
     sizeq: int
+    remq: int
 
-    fragments: List[FragmentInterval] = find_intersected_fragments(
-        fragment_intervals, read_refstart, read_refend)
     basepairs: List[
         Tuple[Header, List[BasePair]]
-    ] = group_basepairs(posnas, fragments)
+    ] = group_basepairs(posnas, fragment_intervals, napos_lookup)
 
     poscodons: List[PosCodon] = []
     for fragment_name, aapos, codon_posnas in group_codons(basepairs):
-        codon, is_partial = get_comparable_codon(codon_posnas)
+        codon, is_partial, totalq = get_comparable_codon(codon_posnas)
         if is_partial:
             continue
 
-        totalq = 0
-        sizeq = 0
-        for pnas in codon_posnas:
-            for pna in pnas:
-                totalq += pna[3]
-                sizeq += 1
-        meanq_int = round(totalq / sizeq if totalq else 0)
+        # every posna contributes one NA to the codon; a complete codon
+        # has at least three. Round half to even like round() does, but
+        # without a float division
+        sizeq = len(codon)
+        meanq_int = totalq // sizeq
+        remq = totalq - meanq_int * sizeq
+        if remq * 2 > sizeq or (remq * 2 == sizeq and meanq_int & 1):
+            meanq_int += 1
         if meanq_int < site_quality_cutoff:
             continue
 
-        poscodons.append((fragment_name, aapos, codon, meanq_int))
+        # the key is built here once and reused by both counters
+        poscodons.append(((fragment_name, aapos, codon), meanq_int))
     return poscodons
 
 
+def init_fragment_intervals(
+    fragment_intervals: List[FragmentInterval]
+) -> None:
+    """Cache fragment intervals and their napos lookup in this process"""
+    global FRAGMENT_INTERVALS, NAPOS_LOOKUP
+    FRAGMENT_INTERVALS = fragment_intervals
+    NAPOS_LOOKUP = build_napos_lookup(fragment_intervals)
+
+
 def iter_poscodons(
     samfile: str,
     samfile_start: int,
     samfile_end: int,
-    fragment_intervals: List[FragmentInterval],
-    site_quality_cutoff: int = 0
+    site_quality_cutoff: int = 0,
+    bam_threads: int = 1
 ) -> Generator[Tuple[Optional[Header], List[PosCodon]], None, None]:
-    """Retrieve poscodons from given SAM/BAM file position range"""
+    """Retrieve poscodons from given SAM/BAM file position range
+
+    Fragment intervals must be set by init_fragment_intervals first.
+    """
 
     read: AlignedSegment
     posnas: List[PosNA]
     poscodons: List[PosCodon]
+    fragment_intervals: List[FragmentInterval] = FRAGMENT_INTERVALS
+    napos_lookup: List[List[Tuple[int, AAPos]]] = NAPOS_LOOKUP
 
-    with pysam.AlignmentFile(samfile, 'rb') as samfp:
+    with pysam.AlignmentFile(
+        samfile, 'rb', threads=bam_threads
+    ) as samfp:
         samfp.seek(samfile_start)
 
         for read in samfp:
@@ -213,15 +281,14 @@ def iter_poscodons(
             posnas = iter_single_read_posnas(
                 read.query_sequence,
                 read.query_qualities,
-                read.get_aligned_pairs(False)
+                read.cigartuples,
+                read.reference_start
             )
 
             poscodons = posnas2poscodons(
                 posnas,
                 fragment_intervals,
-                read.reference_start + 1,  # pysam has 0-based numbering
-                read.reference_end,  # "reference_end points to one past the
-                                     #  last aligned residue."
+                napos_lookup,
                 site_quality_cutoff
             )
 
@@ -4,39 +4,65 @@ from tqdm import tqdm  # type: ignore
 from array import array
 from pysam import AlignedSegment  # type: ignore
 from typing import List, Tuple, Optional, Generator, Any, Union
-from concurrent.futures import ProcessPoolExecutor
 
 from .json_progress import JsonProgress
-from .samfile_helper import chunked_samfile
+from .samfile_helper import (
+    chunked_samfile,
+    chunk_mapper,
+    worker_bam_threads
+)
 from .codfreq_types import NAPos, NAChar, SeqText, Header
+from .posnas_types import PosNA
 
 ENCODING: str = 'UTF-8'
 GAP: int = ord(b'-')
 
-PosNA = Tuple[
-    NAPos,   # refpos
-    int,     # insertion_index
-    NAChar,  # na
-    int      # qua
-]
-
 
 @cython.ccall
 @cython.inline
 @cython.returns(list)
+@cython.locals(
+    op=cython.int,
+    oplen=cython.long,
+    i=cython.long,
+    seqpos0=cython.long,
+    refpos0=cython.long,
+    refpos=cython.long,
+    insidx=cython.int,
+    n=cython.int,
+    q=cython.int,
+    prev_refpos=cython.long,
+    prev_seqpos0=cython.long,
+    buffer_size=cython.Py_ssize_t,
+    seqchars=bytes,
+    quachars=bytes
+)
 def iter_single_read_posnas(
     seq: SeqText,
     qua: Optional[array],
-    aligned_pairs: List[Tuple[Optional[NAPos], Optional[NAPos]]]
+    cigartuples: Optional[List[Tuple[int, int]]],
+    ref_start: NAPos,
+    site_quality_cutoff: int = 0
 ) -> List[PosNA]:
-    seqpos0: Optional[NAPos]
-    refpos0: Optional[NAPos]
+    """Walk the CIGAR of a read and list its PosNAs
+
+    Positions are visited in the same order as
+    AlignedSegment.get_aligned_pairs(False) would yield them, without
+    building the list of pairs.
+    """
+    op: int
+    oplen: int
+    i: int
+    seqpos0: int = 0
+    refpos0: int = ref_start
     refpos: NAPos
     insidx: int = 0
     n: NAChar
     q: int
 
     seqchars: bytes = bytes(seq, ENCODING)
+    # reads without qualities count every base as quality 1
+    quachars: bytes = bytes(qua) if qua else b'\x01' * len(seqchars)
 
     prev_refpos: int = 0
     prev_seqpos0: int = 0
@@ -45,34 +71,59 @@ def iter_single_read_posnas(
 
     posnas: List[PosNA] = []
 
-    for seqpos0, refpos0 in aligned_pairs:
-
-        if refpos0 is None:
-            # insertion
-            refpos = prev_refpos
-            insidx += 1
-        else:
-            refpos = refpos0 + 1
-            insidx = 0
-            prev_refpos = refpos
-
-        if seqpos0 is None:
-            # deletion
-            n, q = GAP, qua[prev_seqpos0] if qua else 1
-        else:
-            n, q = seqchars[seqpos0], qua[seqpos0] if qua else 1
-            prev_seqpos0 = seqpos0
-
-        if refpos == 0:
-            # insertion before the first ref position
+    if not cigartuples:
+        return posnas
+
+    for op, oplen in cigartuples:
+        if op == 5:
+            # hard clip (H): nothing in the query or the reference
             continue
 
-        posnas.append((refpos, insidx, n, q))
+        for i in range(oplen):
+
+            if op == 0 or op == 7 or op == 8:
+                # match/mismatch (M, =, X)
+                refpos = refpos0 + 1
+                insidx = 0
+                prev_refpos = refpos
+                n = seqchars[seqpos0]
+                q = quachars[seqpos0]
+                prev_seqpos0 = seqpos0
+                seqpos0 += 1
+                refpos0 += 1
+
+            elif op == 2 or op == 3:
+                # deletion (D, N)
+                refpos = refpos0 + 1
+                insidx = 0
+                prev_refpos = refpos
+                n = GAP
+                q = quachars[prev_seqpos0]
+                refpos0 += 1
+
+            else:
+                # insertion (I, S, P)
+                refpos = prev_refpos
+                insidx += 1
+                n = seqchars[seqpos0]
+                q = quachars[seqpos0]
+                prev_seqpos0 = seqpos0
+                seqpos0 += 1
+
+            if refpos == 0:
+                # insertion before the first ref position
+                continue
+
+            if insidx == 0:
+                buffer_size = 0
 
-        if insidx > 0:
-            buffer_size += 1
-        else:
-            buffer_size = 0
+            if q < site_quality_cutoff:
+                continue
+
+            posnas.append((refpos, insidx, n, q))
+
+            if insidx > 0:
+                buffer_size += 1
 
     return posnas[:len(posnas) - buffer_size]
 
@@ -83,19 +134,18 @@ def get_posnas_between(
     samfile: str,
     samfile_start: int,
     samfile_end: int,
-    site_quality_cutoff: int = 0
+    site_quality_cutoff: int = 0,
+    bam_threads: int = 1
 ) -> List[Tuple[Optional[Header], List[PosNA]]]:
 
-    pos: NAPos
-    idx: int
-    na: NAChar
-    q: int
     read: AlignedSegment
     posnas: List[PosNA]
 
     results: List[Tuple[Optional[Header], List[PosNA]]] = []
 
-    with pysam.AlignmentFile(samfile, 'rb') as samfp:
+    with pysam.AlignmentFile(
+        samfile, 'rb', threads=bam_threads
+    ) as samfp:
 
         samfp.seek(samfile_start)
 
@@ -109,14 +159,10 @@ def get_posnas_between(
             posnas = iter_single_read_posnas(
                 read.query_sequence,
                 read.query_qualities,
-                read.get_aligned_pairs(False)
+                read.cigartuples,
+                read.reference_start,
+                site_quality_cutoff
             )
-            if site_quality_cutoff > 0:
-                posnas = [
-                    (pos, idx, na, q)
-                    for pos, idx, na, q in posnas
-                    if q >= site_quality_cutoff
-                ]
             results.append((read.query_name, posnas))
 
     return results
@@ -132,10 +178,6 @@ def get_posnas_in_genome_region(
     site_quality_cutoff: int = 0
 ) -> List[Tuple[Optional[Header], List[PosNA]]]:
 
-    pos: NAPos
-    idx: int
-    na: NAChar
-    q: int
     read: AlignedSegment
     posnas: List[PosNA]
 
@@ -151,14 +193,10 @@ def get_posnas_in_genome_region(
             posnas = iter_single_read_posnas(
                 read.query_sequence,
                 read.query_qualities,
-                read.get_aligned_pairs(False)
+                read.cigartuples,
+                read.reference_start,
+                site_quality_cutoff
             )
-            if site_quality_cutoff > 0:
-                posnas = [
-                    (pos, idx, na, q)
-                    for pos, idx, na, q in posnas
-                    if q >= site_quality_cutoff
-                ]
             results.append((read.query_name, posnas))
 
     return results
@@ -200,17 +238,19 @@ def iter_posnas(
             pbar.set_description('Processing {}'.format(description))
 
     chunks = chunked_samfile(samfile, chunk_size)
+    bam_threads: int = worker_bam_threads(workers)
 
-    with ProcessPoolExecutor(workers) as executor:
+    with chunk_mapper(workers) as chunk_map:
 
-        for posnas in executor.map(
+        for posnas in chunk_map(
             get_posnas_between,
             *zip(*[
                 (
                     samfile,
                     samfile_begin,
                     samfile_end,
-                    site_quality_cutoff
+                    site_quality_cutoff,
+                    bam_threads
                 )
                 for samfile_begin, samfile_end in chunks
             ])
@@ -1,6 +1,7 @@
 import pysam  # type: ignore
 import cython  # type: ignore
 from tqdm import tqdm  # type: ignore
+from operator import itemgetter
 from collections import Counter
 from more_itertools import unique_everseen
 
@@ -9,12 +10,12 @@ from typing import (
     List,
     Dict,
     Optional,
+    Generator,
     Any,
     Union,
     Literal,
     Counter as tCounter
 )
-from concurrent.futures import ProcessPoolExecutor
 
 from .codfreq_types import (
     Header,
@@ -37,9 +38,13 @@ from .sam2codfreq_types import (
     TypedRefFragment,
     FragmentGeneLookup
 )
-from .samfile_helper import chunked_samfile
+from .samfile_helper import (
+    chunked_samfile,
+    chunk_mapper,
+    worker_bam_threads
+)
 from .json_progress import JsonProgress
-from .poscodons import iter_poscodons, PosCodon
+from .poscodons import iter_poscodons, init_fragment_intervals, PosCodon
 from .codonalign_consensus import codonalign_consensus
 from .filename_helper import name_bamfile
 
@@ -203,47 +208,63 @@ def to_codon_counter_by_fragpos(
     return dict(reformed)
 
 
-@cython.cfunc
-@cython.inline
-@cython.returns(list)
+@cython.locals(
+    count=cython.long,
+    qua=cython.long,
+    total=cython.long
+)
 def get_codonfreq(
     codonstat_by_fragpos: CodonCounterByFragPos,
     qualities_by_fragpos: CodonCounterByFragPos,
     frag_gene_lookup: FragmentGeneLookup
-) -> List[CodFreqRow]:
+) -> Generator[CodFreqRow, None, None]:
+    """Yield CodFreq rows ordered by gene, position and codon
+
+    Only the (gene, position) keys are sorted up front; the rows of each
+    key are built and sorted when the caller reaches them.
+    """
     fragment_name: Header
     gene: GeneText
     gene_offset: AAPos
     refpos: AAPos
+    position: AAPos
     codons: tCounter[CodonText]
+    quas: tCounter[CodonText]
+    fragposes: List[Tuple[Header, AAPos, GeneText]]
     codon: CodonText
     count: int
     qua: int
     total: int
-    rows: List[CodFreqRow] = []
-    ordered_genes: List[GeneText] = list(unique_everseen([
-        gene for genes in frag_gene_lookup.values() for gene, _ in genes
-    ]))
-
-    for (fragment_name, refpos), codons in codonstat_by_fragpos.items():
-        total = sum(codons.values())
-        for codon, count in codons.items():
-            qua = qualities_by_fragpos[(fragment_name, refpos)][codon]
-            for gene, gene_offset in frag_gene_lookup[fragment_name]:
-                rows.append({
-                    'gene': gene,
-                    'position': refpos + gene_offset,
-                    'total': total,
-                    'codon': codon,
-                    'count': count,
-                    'total_quality_score': round(qua, 2)
-                })
-    rows.sort(key=lambda row: (
-        ordered_genes.index(row['gene']),
-        row['position'],
-        row['codon']
-    ))
-    return rows
+    rows: List[CodFreqRow]
+    # genes are ordered by their first appearance in the profile
+    gene_order: Dict[GeneText, int] = {
+        gene: idx for idx, gene in enumerate(unique_everseen([
+            gene for genes in frag_gene_lookup.values() for gene, _ in genes
+        ]))
+    }
+    fragposes_by_genepos: Dict[
+        Tuple[int, AAPos],
+        List[Tuple[Header, AAPos, GeneText]]
+    ] = {}
+
+    for fragment_name, refpos in codonstat_by_fragpos:
+        for gene, gene_offset in frag_gene_lookup[fragment_name]:
+            fragposes_by_genepos.setdefault(
+                (gene_order[gene], refpos + gene_offset), []
+            ).append((fragment_name, refpos, gene))
+
+    for (_, position), fragposes in sorted(fragposes_by_genepos.items()):
+        rows = []
+        for fragment_name, refpos, gene in fragposes:
+            codons = codonstat_by_fragpos[(fragment_name, refpos)]
+            total = sum(codons.values())
+            quas = qualities_by_fragpos[(fragment_name, refpos)]
+            for codon, count in codons.items():
+                qua = round(quas[codon], 2)
+                # in CODFREQ_HEADER order, ready for csv.writer
+                rows.append((gene, position, total, codon, count, qua))
+        rows.sort(key=itemgetter(3))
+        yield from rows
 
 
 @cython.ccall
@@ -252,8 +273,8 @@ def sam2codfreq_between(
     samfile: str,
     samfile_start: int,
     samfile_end: int,
-    fragment_intervals: List[FragmentInterval],
-    site_quality_cutoff: int = 0
+    site_quality_cutoff: int = 0,
+    bam_threads: int = 1
 ) -> Tuple[CodonCounter, CodonCounter, int]:
     """subprocess function to call iter_poscodons and count codons
 
@@ -273,9 +294,7 @@ def sam2codfreq_between(
     instead of in main process.
     """
     poscodons: List[PosCodon]
-    fragment_name: str
-    refpos: int
-    codon: CodonText
+    key: Tuple[Header, AAPos, CodonText]
     qua: int
     codonstat: CodonCounter = Counter()
     qualities: CodonCounter = Counter()
@@ -285,13 +304,14 @@ def sam2codfreq_between(
         samfile,
         samfile_start,
         samfile_end,
-        fragment_intervals,
-        site_quality_cutoff
+        site_quality_cutoff,
+        bam_threads
     ):
         num_row += 1
-        for fragment_name, refpos, codon, qua in poscodons:
-            codonstat[(fragment_name, refpos, codon)] += 1
-            qualities[(fragment_name, refpos, codon)] += qua
+        # Counter.update() counts an iterable of keys in C
+        codonstat.update([key for key, _ in poscodons])
+        for key, qua in poscodons:
+            qualities[key] += qua
 
     return codonstat, qualities, num_row
 
@@ -347,18 +367,23 @@ def sam2codfreq(
     ] = build_fragment_intervals(fragments)
     codonstat: CodonCounter = Counter()
     qualities: CodonCounter = Counter()
+    bam_threads: int = worker_bam_threads(workers)
 
-    with ProcessPoolExecutor(workers) as executor:
+    with chunk_mapper(
+        workers,
+        init_fragment_intervals,
+        (fragment_intervals,)
+    ) as chunk_map:
 
-        for partial_codonstat, partial_qualities, num_row in executor.map(
+        for partial_codonstat, partial_qualities, num_row in chunk_map(
             sam2codfreq_between,
             *zip(*[
                 (
                     samfile,
                     samfile_begin,
                     samfile_end,
-                    fragment_intervals,
-                    site_quality_cutoff
+                    site_quality_cutoff,
+                    bam_threads
                 )
                 for samfile_begin, samfile_end in chunks
             ])
@@ -401,7 +426,7 @@ def sam2codfreq_all(
     site_quality_cutoff: int = 0,
     log_format: str = 'text',
     include_partial_codons: bool = False
-) -> List[CodFreqRow]:
+) -> Generator[CodFreqRow, None, None]:
     refname: str
     ref: MainFragmentConfig
     fragments: List[DerivedFragmentConfig]
@@ -423,9 +448,8 @@ def sam2codfreq_all(
         all_codonstat_by_fragpos.update(codonstat_by_fragpos)
         all_qualities_by_fragpos.update(qualities_by_fragpos)
 
-    codfreq_rows: List[CodFreqRow] = get_codonfreq(
+    yield from get_codonfreq(
         all_codonstat_by_fragpos,
         all_qualities_by_fragpos,
         frag_gene_lookup
     )
-    return codfreq_rows
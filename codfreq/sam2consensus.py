@@ -1,13 +1,14 @@
 import json
 import cython  # type: ignore
-from collections import defaultdict, Counter
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 from typing import (
-    DefaultDict,
     Counter as tCounter,
     Tuple,
     List,
-    Dict
+    Dict,
+    Optional
 )
 from .codfreq_types import (
     NAPos,
@@ -18,7 +19,8 @@ from .codfreq_types import (
     NARegionConfig,
     RegionalConsensus
 )
-from .posnas import get_posnas_in_genome_region, PosNA
+from .posnas import get_posnas_in_genome_region
+from .posnas_types import PosNA
 
 from .filename_helper import name_bamfile
 
@@ -74,11 +76,10 @@ def sam2consensus(
     refpos: NAPos
     idx: int
     na: NAChar
+    count: int
+    best: Optional[Tuple[NAChar, int]]
 
-    nafreqs: DefaultDict[
-        Tuple[NAPos, int],
-        tCounter[NAChar]
-    ] = defaultdict(Counter)
+    nafreqs: tCounter[Tuple[NAPos, int, NAChar]] = Counter()
 
     for _, posnas in get_posnas_in_genome_region(
         sampath,
@@ -86,13 +87,15 @@ def sam2consensus(
         ref_start=region['refStart'],
         ref_end=region['refEnd']
     ):
-        for refpos, idx, na, _ in posnas:
-            nafreqs[(refpos, idx)][na] += 1
-
-    nacons_with_count_lookup: Dict[Tuple[NAPos, int], Tuple[NAChar, int]] = {
-        pos: nas.most_common(1)[0]
-        for pos, nas in nafreqs.items()
-    }
+        nafreqs.update([(refpos, idx, na) for refpos, idx, na, _ in posnas])
+
+    # keys of the same position are visited in first-seen order; a strict
+    # comparison keeps the earliest NA on ties, same as most_common(1)
+    nacons_with_count_lookup: Dict[Tuple[NAPos, int], Tuple[NAChar, int]] = {}
+    for (refpos, idx, na), count in nafreqs.items():
+        best = nacons_with_count_lookup.get((refpos, idx))
+        if best is None or count > best[1]:
+            nacons_with_count_lookup[(refpos, idx)] = (na, count)
     nacons_lookup: Dict[Tuple[NAPos, int], NAChar] = {
         (pos, idx): na
         for (pos, idx), (na, count) in nacons_with_count_lookup.items()
@@ -106,44 +109,65 @@ def sam2consensus(
     return r
 
 
+@cython.cfunc
+@cython.inline
+@cython.returns(dict)
+def prepare_untrans_regions(
+    profile: Profile
+) -> Dict[str, List[NARegionConfig]]:
+    region: SequenceAssemblyConfig
+    plan: Dict[str, List[NARegionConfig]] = {}
+
+    for region in profile['sequenceAssemblyConfig']:
+        if 'name' not in region or region['name'] is None:
+            continue
+        if 'fromFragment' not in region or region['fromFragment'] is None:
+            continue
+        if 'refStart' not in region or region['refStart'] is None:
+            continue
+        if 'refEnd' not in region or region['refEnd'] is None:
+            continue
+        plan.setdefault(region['fromFragment'], []).append({
+            'name': region['name'],
+            'fromFragment': region['fromFragment'],
+            'refStart': region['refStart'],
+            'refEnd': region['refEnd']
+        })
+    return plan
+
+
 @cython.ccall
 @cython.returns(cython.void)
 def create_untrans_region_consensus(
     seqname: str,
-    profile: Profile
+    profile: Profile,
+    workers: int = 1
 ) -> None:
 
     refname: str
     samfile: str
     fragment: FragmentConfig
-    region: SequenceAssemblyConfig
+    ref_regions: List[NARegionConfig]
 
-    results: List[RegionalConsensus] = []
+    plan: Dict[str, List[NARegionConfig]] = prepare_untrans_regions(profile)
+    samfiles: List[str] = []
+    regions: List[NARegionConfig] = []
+    results: List[RegionalConsensus]
     for fragment in profile['fragmentConfig']:
         if 'fromFragment' in fragment:
             continue
         refname = fragment['fragmentName']
+        ref_regions = plan.get(refname, [])
+        if not ref_regions:
+            continue
         samfile = name_bamfile(seqname, refname, is_trimmed=True)
-        for region in profile['sequenceAssemblyConfig']:
-            if region.get('fromFragment') != refname:
-                continue
-            if 'name' not in region or region['name'] is None:
-                continue
-            if 'fromFragment' not in region or region['fromFragment'] is None:
-                continue
-            if 'refStart' not in region or region['refStart'] is None:
-                continue
-            if 'refEnd' not in region or region['refEnd'] is None:
-                continue
-
-            results.append(sam2consensus(
-                samfile,
-                {
-                    'name': region['name'],
-                    'fromFragment': region['fromFragment'],
-                    'refStart': region['refStart'],
-                    'refEnd': region['refEnd']
-                }
-            ))
+        samfiles.extend([samfile] * len(ref_regions))
+        regions.extend(ref_regions)
+
+    if workers > 1 and len(regions) > 1:
+        with ProcessPoolExecutor(min(workers, len(regions))) as executor:
+            results = list(executor.map(sam2consensus, samfiles, regions))
+    else:
+        results = list(map(sam2consensus, samfiles, regions))
     with open('{}.untrans.json'.format(seqname), 'w') as fp:
         json.dump(results, fp)
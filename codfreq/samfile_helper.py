@@ -1,6 +1,20 @@
+import os
 import pysam  # type: ignore
 import cython  # type: ignore
-from typing import List, Tuple
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Callable, Iterator, Optional, Any
+
+# number of htslib threads used to decompress BAM files which are scanned
+# sequentially by the main process
+BAM_THREADS: int = int(
+    os.environ.get('CODFREQ_BAM_THREADS', os.cpu_count() or 1)
+)
+
+
+def worker_bam_threads(workers: int) -> int:
+    """Share BAM_THREADS among the given number of worker processes"""
+    return max(1, BAM_THREADS // max(1, workers))
 
 
 @cython.ccall
@@ -17,7 +31,9 @@ def chunked_samfile(
     cur_begin: int
     cur_end: int
 
-    with pysam.AlignmentFile(samfile, 'rb') as samfp:
+    with pysam.AlignmentFile(
+        samfile, 'rb', threads=BAM_THREADS
+    ) as samfp:
         cur_begin = samfp.tell()
         cur_chunk_size = 0
 
@@ -34,3 +50,27 @@ def chunked_samfile(
             chunks.append((cur_begin, cur_end))
 
     return chunks
+
+
+@contextmanager
+def chunk_mapper(
+    workers: int,
+    initializer: Optional[Callable[..., None]] = None,
+    initargs: Tuple[Any, ...] = ()
+) -> Iterator[Callable]:
+    """Yield a map function running in a process pool when workers > 1
+
+    The initializer, if given, runs once in each worker process, or in the
+    current process when no pool is used.
+    """
+    if workers > 1:
+        with ProcessPoolExecutor(
+            workers,
+            initializer=initializer,
+            initargs=initargs
+        ) as executor:
+            yield executor.map
+    else:
+        if initializer:
+            initializer(*initargs)
+        yield map
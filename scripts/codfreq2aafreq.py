@@ -4,6 +4,7 @@ import os
 import csv
 import gzip
 import argparse
+from functools import lru_cache
 from collections import Counter, defaultdict
 
 from typing import (
@@ -95,6 +96,8 @@ CODON_TABLE: Dict[str, str] = {
 }
 
 
+# every CodFreq row is translated, but distinct codons are few
+@lru_cache(maxsize=4096)
 def codon_to_aa(codon: str) -> Tuple[str, str]:
     nogap = codon.replace('-', '')
     nogap_len = len(nogap)
@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 
 CODON_TABLE = {
     'TTT': 'F',
@@ -107,16 +108,35 @@ def expand_ambiguous_na(na):
     return AMBIGUOUS_NAS.get(na, na)
 
 
-def translate_codon(nas):
-    nas = nas.replace('-', 'N')[:3]
-    if nas in CODON_TABLE:
-        return CODON_TABLE[nas]
+NA_BITMASK = {'A': 1, 'C': 2, 'G': 4, 'T': 8}
+for na, expanded in AMBIGUOUS_NAS.items():
+    NA_BITMASK[na] = sum(NA_BITMASK[exp_na] for exp_na in expanded)
+NA_BITMASK['-'] = NA_BITMASK['N']
+
+BITMASK_NAS = {
+    bitmask: [na for na in 'ACGT' if NA_BITMASK[na] & bitmask]
+    for bitmask in range(16)
+}
+
+
+@lru_cache(maxsize=4096)
+def translate_codon_bitmask(key):
     aas = set()
-    for na0 in AMBIGUOUS_NAS.get(nas[0], nas[0]):
-        for na1 in AMBIGUOUS_NAS.get(nas[1], nas[1]):
-            for na2 in AMBIGUOUS_NAS.get(nas[2], nas[2]):
+    for na0 in BITMASK_NAS[key >> 8]:
+        for na1 in BITMASK_NAS[key >> 4 & 0xf]:
+            for na2 in BITMASK_NAS[key & 0xf]:
                 aas.add(CODON_TABLE[na0 + na1 + na2])
-    CODON_TABLE[nas] = aas = ''.join(sorted(aas))
+    return ''.join(sorted(aas))
+
+
+def translate_codon(nas):
+    aas = translate_codon_bitmask(
+        NA_BITMASK.get(nas[0], 0) << 8 |
+        NA_BITMASK.get(nas[1], 0) << 4 |
+        NA_BITMASK.get(nas[2], 0)
+    )
+    if not aas:
+        raise KeyError(nas[:3])
     return aas
 
 
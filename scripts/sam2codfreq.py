@@ -5,8 +5,8 @@ import os
 import sys
 import csv
 import pysam
-from statistics import mean
-from multiprocessing import Process, Queue
+from threading import BoundedSemaphore
+from multiprocessing import Pool
 from collections import defaultdict, Counter
 
 REF_CODON_OFFSET = 0
@@ -22,11 +22,14 @@ OVERALL_QUALITY_CUTOFF = int(os.environ.get('OVERALL_QUALITY_CUTOFF', 25))
 LENGTH_CUTOFF = int(os.environ.get('LENGTH_CUTOFF', 50))
 SITE_QUALITY_CUTOFF = int(os.environ.get('SITE_QUALITY_CUTOFF', 25))
 
-NUM_PROCESSES = int(os.environ.get('NTHREADS', 2))
-INPUT_QUEUE = Queue(NUM_PROCESSES)
-OUTPUT_QUEUE = Queue()
+# per-quality byte masks: keep the base (0xff) or overwrite it with '*'
+KEEP_MASK = bytes(0x00 if q < SITE_QUALITY_CUTOFF else 0xff
+                  for q in range(256))
+STAR_MASK = bytes(ord('*') if q < SITE_QUALITY_CUTOFF else 0x00
+                  for q in range(256))
+STAR_TO_N = bytes.maketrans(b'*', b'N')
 
-PRODUCER_CAPACITY = 50000
+NUM_PROCESSES = int(os.environ.get('NTHREADS', 2))
 
 CHUNKSIZE = 500
 
@@ -34,83 +37,130 @@ ERR_OK = 0b00
 ERR_TOO_SHORT = 0b01
 ERR_LOW_QUAL = 0b10
 
-
-def get_codon_counts(seq, qua, aligned_pairs, header):
-
-    # pre-filter
-    err = ERR_OK
-    if len(seq) < LENGTH_CUTOFF:
-        err |= ERR_TOO_SHORT
-    if mean(qua) < OVERALL_QUALITY_CUTOFF:
-        err |= ERR_LOW_QUAL
-    if err:
-        return None, err
-
+# see https://samtools.github.io/hts-specs/SAMv1.pdf
+CIGAR_MATCH_OPS = (0, 7, 8)  # M, =, X
+CIGAR_DELETION_OPS = (2, 3)  # D, N
+CIGAR_HARD_CLIP = 5  # H
+
+
+def mask_low_quality(seqbytes, qua):
+    quabytes = bytes(qua)
+    masked = (
+        int.from_bytes(seqbytes, 'big') &
+        int.from_bytes(quabytes.translate(KEEP_MASK), 'big') |
+        int.from_bytes(quabytes.translate(STAR_MASK), 'big')
+    )
+    return masked.to_bytes(len(seqbytes), 'big')
+
+
+def fill_codon_slot(codons, codonpos, codonbp, nas):
+    codon = codons.get(codonpos)
+    if codon is None:
+        codon = codons[codonpos] = bytearray(b'---')
+    # slots are filled in ascending order, so each unfilled slot is still a
+    # single trailing '-' and can be located from the end
+    offset = len(codon) - 3 + codonbp
+    codon[offset:offset + 1] = nas
+
+
+def get_matched_pairs(cigartuples, ref_start):
+    """Same pairs as AlignedSegment.get_aligned_pairs(True), from CIGAR"""
+    pairs = []
+    seqpos0 = 0
+    refpos0 = ref_start
+    for op, oplen in cigartuples or ():
+        if op in CIGAR_MATCH_OPS:
+            pairs.extend(zip(range(seqpos0, seqpos0 + oplen),
+                             range(refpos0, refpos0 + oplen)))
+            seqpos0 += oplen
+            refpos0 += oplen
+        elif op in CIGAR_DELETION_OPS:
+            refpos0 += oplen
+        elif op != CIGAR_HARD_CLIP:
+            # I, S and P only consume the query
+            seqpos0 += oplen
+    return pairs
+
+
+def prefilter_read(seq, qua):
+    # the length check is cheap and outranks the quality check
+    if not seq or len(seq) < LENGTH_CUTOFF:
+        return ERR_TOO_SHORT
+    if not qua or sum(qua) < OVERALL_QUALITY_CUTOFF * len(qua):
+        return ERR_LOW_QUAL
+    return ERR_OK
+
+
+def get_codon_counts(seq, qua, cigartuples, ref_start, header):
+    aligned_pairs = get_matched_pairs(cigartuples, ref_start)
     codons = {}
+    seqbytes = seq.encode('ASCII')
+    masked = mask_low_quality(seqbytes, qua)
     prev_seqpos = -1
     min_cdpos = aligned_pairs[-1][1] if aligned_pairs else 0xffffffff
+    if len(aligned_pairs) > 1:
+        # refpos only grows; the second pair fills the first codon
+        min_cdpos = (aligned_pairs[1][1] - 1 - REF_CODON_OFFSET) // 3 + 1
     max_cdpos = 0
     for seqpos, refpos in aligned_pairs:
         if prev_seqpos > -1:
             codonpos = (refpos - 1 - REF_CODON_OFFSET) // 3 + 1
             codonbp = (refpos - 1 - REF_CODON_OFFSET) % 3
-            min_cdpos = min(min_cdpos, codonpos)
-            nas = []
-            for n, q in zip(seq[prev_seqpos:seqpos],
-                            qua[prev_seqpos:seqpos]):
-                if q < SITE_QUALITY_CUTOFF:
-                    n = '*'
-                nas.append(n)
-            if codonpos not in codons:
-                codons[codonpos] = ['-'] * 3
-            codons[codonpos][codonbp] = ''.join(nas)
+            fill_codon_slot(codons, codonpos, codonbp,
+                            masked[prev_seqpos:seqpos])
         prev_seqpos = seqpos
     if prev_seqpos > -1:
         codonpos = (refpos - REF_CODON_OFFSET) // 3 + 1
         codonbp = (refpos - REF_CODON_OFFSET) % 3
-        if codonpos not in codons:
-            codons[codonpos] = ['-'] * 3
-        codons[codonpos][codonbp] = seq[prev_seqpos]
+        fill_codon_slot(codons, codonpos, codonbp,
+                        seqbytes[prev_seqpos:prev_seqpos + 1])
         max_cdpos = codonpos
     results = []
     for cdpos in range(min_cdpos, max_cdpos + 1):
-        codon = ''.join(codons.get(cdpos, ['---']))
-        codon = codon if codon == '---' else codon.replace('-', '')
-        # codon = codon.replace('-', '')
-        if len(codon) - codon.count('*') < 3:
+        codon = codons.get(cdpos)
+        if codon is None or codon == b'---':
+            results.append((cdpos, b'---'))
+            continue
+        num_masked = codon.count(b'*')
+        # drop gaps and turn masked bases into N in a single pass
+        codon = bytes(codon.translate(STAR_TO_N, b'-'))
+        if len(codon) - num_masked < 3:
             continue
-        codon = codon.replace('*', 'N')
         results.append((cdpos, codon))
-    return results, err
+    return results, ERR_OK
 
 
-def reads_consumer():
-    while True:
-        chunk = INPUT_QUEUE.get()
-        out_chunk = []
-        for args in chunk:
-            out_chunk.append(get_codon_counts(*args))
-        OUTPUT_QUEUE.put(out_chunk)
+def get_chunk_codon_counts(chunk):
+    errs, reads = chunk
+    return (
+        [(None, err) for err in errs] +
+        [get_codon_counts(*args) for args in reads]
+    )
 
 
-def reads_producer(filename, offset):
+def iter_read_chunks(filename, inflight):
     with pysam.AlignmentFile(filename, 'rb') as samfile:
-        chunk = []
-        limit = offset + PRODUCER_CAPACITY
+        errs = []
+        reads = []
         for idx, read in enumerate(samfile.fetch()):
-            if idx < offset:
+            seq, qua = read.query_sequence, read.query_qualities
+            err = prefilter_read(seq, qua)
+            if err:
+                # rejected reads are not aligned nor shipped to the workers;
+                # only their error codes are passed along for the tallies
+                errs.append(err)
                 continue
-            if idx >= limit:
-                break
-            seq, qua, aligned_pairs = (read.query_sequence,
-                                       read.query_qualities,
-                                       read.get_aligned_pairs(True))
-            if len(chunk) == CHUNKSIZE:
-                INPUT_QUEUE.put(chunk)
-                chunk = []
-            chunk.append((seq, qua, aligned_pairs, idx + offset))
-        if chunk:
-            INPUT_QUEUE.put(chunk)
+            if len(reads) == CHUNKSIZE:
+                # blocks until the main process has drained a result
+                inflight.acquire()
+                yield errs, reads
+                errs = []
+                reads = []
+            reads.append((seq, qua, read.cigartuples,
+                          read.reference_start, idx))
+        if errs or reads:
+            inflight.acquire()
+            yield errs, reads
 
 
 def main():
@@ -118,35 +168,26 @@ def main():
         print("Usage: {} <SAMFILE> <OUTPUT>".format(sys.argv[0]),
               file=sys.stderr)
         exit(1)
-    with pysam.AlignmentFile(sys.argv[1], 'rb') as samfile:
-        totalreads = samfile.count(until_eof=True)
-    offset = 0
-    while offset < totalreads:
-        producer = Process(target=reads_producer, args=(sys.argv[1], offset))
-        producer.daemon = True
-        producer.start()
-        offset += PRODUCER_CAPACITY
-
-    for _ in range(NUM_PROCESSES):
-        consumer = Process(target=reads_consumer)
-        consumer.daemon = True
-        consumer.start()
-
     codonfreqs = defaultdict(Counter)
     num_finished = 0
     num_tooshort = 0
     num_lowqual = 0
-    while num_finished < totalreads:
-        out_chunk = OUTPUT_QUEUE.get()
-        for results, err in out_chunk:
-            num_finished += 1
-            if err & ERR_TOO_SHORT:
-                num_tooshort += 1
-            elif err & ERR_LOW_QUAL:
-                num_lowqual += 1
-            else:
-                for cdpos, codon in results:
-                    codonfreqs[cdpos][codon] += 1
+    inflight = BoundedSemaphore(NUM_PROCESSES * 2)
+    with Pool(NUM_PROCESSES) as pool:
+        for out_chunk in pool.imap_unordered(
+            get_chunk_codon_counts,
+            iter_read_chunks(sys.argv[1], inflight)
+        ):
+            inflight.release()
+            for results, err in out_chunk:
+                num_finished += 1
+                if err & ERR_TOO_SHORT:
+                    num_tooshort += 1
+                elif err & ERR_LOW_QUAL:
+                    num_lowqual += 1
+                else:
+                    for cdpos, codon in results:
+                        codonfreqs[cdpos][codon] += 1
 
     with open(sys.argv[2], 'w') as out:
         writer = csv.writer(out, delimiter='\t')
@@ -160,7 +201,8 @@ def main():
             total = sum(counter.values())
             for codon, read in sorted(counter.items(),
                                       key=lambda it: (-it[1], it[0])):
-                writer.writerow([gene, cdpos, total, codon, read])
+                writer.writerow([gene, cdpos, total,
+                                 codon.decode('ASCII'), read])
     print('{} reads processed. Of them:'.format(num_finished))
     print('  Length of {} were too short'.format(num_tooshort))
     print('  Quality of {} were too low'.format(num_lowqual))
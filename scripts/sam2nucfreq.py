@@ -6,9 +6,9 @@ import sys
 import csv
 import json
 import pysam
-import fastareader
-from statistics import mean
-from multiprocessing import Process, Queue
+from codfreq import fastareader
+from threading import BoundedSemaphore
+from multiprocessing import Pool
 from collections import defaultdict, Counter
 
 REF_CODON_OFFSET = 0
@@ -19,10 +19,6 @@ LENGTH_CUTOFF = int(os.environ.get('LENGTH_CUTOFF', 50))
 SITE_QUALITY_CUTOFF = int(os.environ.get('SITE_QUALITY_CUTOFF', 35))
 
 NUM_PROCESSES = int(os.environ.get('NTHREADS', 2))
-INPUT_QUEUE = Queue(NUM_PROCESSES)
-OUTPUT_QUEUE = Queue()
-
-PRODUCER_CAPACITY = 50000
 
 CHUNKSIZE = 500
 
@@ -30,6 +26,11 @@ ERR_OK = 0b00
 ERR_TOO_SHORT = 0b01
 ERR_LOW_QUAL = 0b10
 
+# see https://samtools.github.io/hts-specs/SAMv1.pdf
+CIGAR_MATCH_OPS = (0, 7, 8)  # M, =, X
+CIGAR_DELETION_OPS = (2, 3)  # D, N
+CIGAR_HARD_CLIP = 5  # H
+
 
 def read_popprev():
     loc = os.path.join(
@@ -42,23 +43,49 @@ def read_popprev():
             for i in popprev}
 
 
-def get_na_counts(seq, qua, aligned_pairs, header, profile):
-
-    # pre-filter
-    err = ERR_OK
-    if len(seq) < LENGTH_CUTOFF:
-        err |= ERR_TOO_SHORT
-    if mean(qua) < OVERALL_QUALITY_CUTOFF:
-        err |= ERR_LOW_QUAL
-    if err:
-        return None, err
-
-    nas = defaultdict(list)
+def iter_aligned_pairs(cigartuples, ref_start):
+    """Same pairs as AlignedSegment.get_aligned_pairs(False), from CIGAR"""
+    seqpos0 = 0
+    refpos0 = ref_start
+    for op, oplen in cigartuples or ():
+        if op in CIGAR_MATCH_OPS:
+            for _ in range(oplen):
+                yield seqpos0, refpos0
+                seqpos0 += 1
+                refpos0 += 1
+        elif op in CIGAR_DELETION_OPS:
+            for _ in range(oplen):
+                yield None, refpos0
+                refpos0 += 1
+        elif op != CIGAR_HARD_CLIP:
+            # I, S and P only consume the query
+            for _ in range(oplen):
+                yield seqpos0, None
+                seqpos0 += 1
+
+
+def get_na_counts(seq, qua, cigartuples, ref_start, header, profile):
+
+    # pre-filter; the length check is cheap and outranks the quality check
+    if not seq or len(seq) < LENGTH_CUTOFF:
+        return None, ERR_TOO_SHORT
+    if not qua:
+        return None, ERR_LOW_QUAL
+    if sum(qua) < OVERALL_QUALITY_CUTOFF * len(qua):
+        return None, ERR_LOW_QUAL
+
+    # refpos never decreases along the alignment, so bases and insertions of
+    # the same position always come in one contiguous run
+    result_nas = []
+    run_refpos = 0
+    run_nas = []
+    run_qsum = 0
+    run_qcnt = 0
     prev_refpos = 0
     prev_seqpos0 = 0
     profile_char = ':'
     insoffset = 0
-    for seqpos0, refpos0 in aligned_pairs:
+    for seqpos0, refpos0 in iter_aligned_pairs(cigartuples, ref_start):
         if profile and refpos0 is not None:
             profile_char, insoffset = profile[refpos0]
 
@@ -80,49 +107,49 @@ def get_na_counts(seq, qua, aligned_pairs, header, profile):
         if refpos == 0:
             continue
 
-        nas[refpos].append((n, q))
-
-    result_nas = []
-    for pos, nqs in sorted(nas.items()):
-        qs = [q for _, q in nqs]
-        meanq = sum(qs) / len(qs)
-        if meanq < SITE_QUALITY_CUTOFF:
-            continue
-        result_nas.append((pos, ''.join(n for n, _ in nqs)))
+        if refpos != run_refpos:
+            if run_nas and run_qsum / run_qcnt >= SITE_QUALITY_CUTOFF:
+                result_nas.append((run_refpos, ''.join(run_nas)))
+            run_refpos = refpos
+            run_nas = []
+            run_qsum = run_qcnt = 0
+        run_nas.append(n)
+        run_qsum += q
+        run_qcnt += 1
+
+    if run_nas and run_qsum / run_qcnt >= SITE_QUALITY_CUTOFF:
+        result_nas.append((run_refpos, ''.join(run_nas)))
     if result_nas:
         lastpos, lastna = result_nas[-1]
         # remove insertion at the end of sequence read
         result_nas[-1] = (lastpos, lastna[0])
-    return result_nas, err
+    return result_nas, ERR_OK
+
+
+def init_profile(profile):
+    # the profile is shipped once per worker instead of once per chunk
+    global PROFILE
+    PROFILE = profile
 
 
-def reads_consumer(profile):
-    while True:
-        chunk = INPUT_QUEUE.get()
-        out_chunk = []
-        for args in chunk:
-            out_chunk.append(get_na_counts(*args, profile))
-        OUTPUT_QUEUE.put(out_chunk)
+def get_chunk_na_counts(chunk):
+    return [get_na_counts(*args, PROFILE) for args in chunk]
 
 
-def reads_producer(filename, offset):
+def iter_read_chunks(filename, inflight):
     with pysam.AlignmentFile(filename, 'rb') as samfile:
         chunk = []
-        limit = offset + PRODUCER_CAPACITY
         for idx, read in enumerate(samfile.fetch()):
-            if idx < offset:
-                continue
-            if idx >= limit:
-                break
-            seq, qua, aligned_pairs = (read.query_sequence,
-                                       read.query_qualities,
-                                       read.get_aligned_pairs(False))
             if len(chunk) == CHUNKSIZE:
-                INPUT_QUEUE.put(chunk)
+                # blocks until the main process has drained a result
+                inflight.acquire()
+                yield chunk
                 chunk = []
-            chunk.append((seq, qua, aligned_pairs, idx + offset))
+            chunk.append((read.query_sequence, read.query_qualities,
+                          read.cigartuples, read.reference_start, idx))
         if chunk:
-            INPUT_QUEUE.put(chunk)
+            inflight.acquire()
+            yield chunk
 
 
 def main():
@@ -131,9 +158,6 @@ def main():
               file=sys.stderr)
         exit(1)
     samfile_path = sys.argv[1]
-    with pysam.AlignmentFile(samfile_path, 'rb') as samfile:
-        # set until_eof=False to exclude unmapped reads
-        totalreads = samfile.count(until_eof=False)
     reffilepath = samfile_path[:-4] + '.lastref.fas'
     profile = []
     if os.path.isfile(reffilepath):
@@ -149,37 +173,31 @@ def main():
                     if c == '+':
                         totalins += 1
                     profile.append([c, totalins])
-    offset = 0
-    while offset < totalreads:
-        producer = Process(target=reads_producer, args=(sys.argv[1], offset))
-        producer.daemon = True
-        producer.start()
-        offset += PRODUCER_CAPACITY
-
-    for _ in range(NUM_PROCESSES):
-        consumer = Process(target=reads_consumer, args=(profile,))
-        consumer.daemon = True
-        consumer.start()
 
     nafreqs = defaultdict(Counter)
     insdetail = defaultdict(Counter)
     num_finished = 0
     num_tooshort = 0
     num_lowqual = 0
-    while num_finished < totalreads:
-        out_chunk = OUTPUT_QUEUE.get()
-        for results, err in out_chunk:
-            num_finished += 1
-            if err & ERR_TOO_SHORT:
-                num_tooshort += 1
-            elif err & ERR_LOW_QUAL:
-                num_lowqual += 1
-            else:
-                for refpos, na in results:
-                    if len(na) > 1:
-                        insdetail[refpos][na] += 1
-                        na = 'i'
-                    nafreqs[refpos][na] += 1
+    inflight = BoundedSemaphore(NUM_PROCESSES * 2)
+    with Pool(NUM_PROCESSES, init_profile, (profile,)) as pool:
+        for out_chunk in pool.imap_unordered(
+            get_chunk_na_counts,
+            iter_read_chunks(samfile_path, inflight)
+        ):
+            inflight.release()
+            for results, err in out_chunk:
+                num_finished += 1
+                if err & ERR_TOO_SHORT:
+                    num_tooshort += 1
+                elif err & ERR_LOW_QUAL:
+                    num_lowqual += 1
+                else:
+                    for refpos, na in results:
+                        if len(na) > 1:
+                            insdetail[refpos][na] += 1
+                            na = 'i'
+                        nafreqs[refpos][na] += 1
 
     all_popprev = read_popprev()
     with open(sys.argv[2], 'w') as out:
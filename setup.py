@@ -49,6 +49,11 @@ extensions = [
         name='codfreq.sam2consensus',
         sources=['codfreq/sam2consensus.py'],
         # define_macros=[('CYTHON_TRACE', '1')]
+    ),
+    Extension(
+        name='codfreq.sam_prep',
+        sources=['codfreq/sam_prep.py'],
+        # define_macros=[('CYTHON_TRACE', '1')]
     )
 ]
 